@@ -1,16 +1,30 @@
 import csv
+import hashlib
 import os
+import re
+import shutil
 import subprocess
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+from PIL import Image, ImageDraw, ImageFont
+
 # -----------------------
 # CONFIG (edit if needed)
 # -----------------------
 ROOT = Path(r"C:\jpvideo")
 CSV_PATH = ROOT / "cards.tsv"
 OUT_DIR = ROOT / "out"
-TMP_DIR = ROOT / "tmp"
+# Encoded batches, named by a hash of their cards and the render settings, so
+# re-running on an unchanged deck skips the encode (safe to delete at any time)
+CACHE_DIR = ROOT / "cache"
+# Part of every cache key - bump it whenever the render code changes in a way the
+# settings don't capture (wrapping/kinsoku rules, filter graph, encoder flags)
+CACHE_VERSION = 1
+# Other intermediate files (PNGs, filter scripts, concat list) go in a per-run
+# tempfile.TemporaryDirectory, which is removed automatically at the end
 
 FONT_PATH = r"C:\Windows\Fonts\NotoSansJP-VF.ttf"
 
@@ -19,6 +33,20 @@ WIDTH, HEIGHT = 1920, 1080
 FPS = 30
 BG_COLOR = "#111111"
 
+# Encoder settings - slides are static text, so the fastest x264 preset loses
+# next to nothing in quality
+PRESET = "ultrafast"
+TUNE = "stillimage"
+CRF = 23
+
+# Hardware encoders are tried in this order, falling back to libx264
+ENCODERS = {
+    "h264_nvenc": ["-preset", "p1", "-tune", "ll", "-rc", "vbr", "-cq", str(CRF), "-pix_fmt", "yuv420p"],
+    "h264_qsv": ["-preset", "veryfast", "-global_quality", str(CRF), "-pix_fmt", "nv12"],
+    "h264_amf": ["-quality", "speed", "-rc", "cqp", "-qp_i", str(CRF), "-qp_p", str(CRF), "-pix_fmt", "yuv420p"],
+    "libx264": ["-preset", PRESET, "-tune", TUNE, "-crf", str(CRF), "-pix_fmt", "yuv420p"],
+}
+
 # Timing (seconds)
 WORD_S = 5          # Word displays for 5 seconds
 PAUSE1_S = 0        # No pause - transitions directly to info
@@ -32,6 +60,10 @@ READING_SIZE = 92
 JP_EX_SIZE = 96
 EN_EX_SIZE = 50
 
+# Text colors (RGBA)
+TEXT_COLOR = (255, 255, 255, 255)
+EN_TEXT_COLOR = (255, 255, 255, 235)  # white @ 0.92
+
 # Text wrapping - maximum width for text (leaves margins on sides)
 # Very conservative to prevent clipping - leave large margins
 TEXT_MAX_WIDTH = 1200  # pixels (out of 1920 total width, leaves 360px margin on each side)
@@ -45,17 +77,39 @@ EN_EX_Y = 500
 # Line spacing for wrapped text (pixels between lines)
 LINE_SPACING = 15
 
+# Batching - a deck longer than MAX_BATCH_CARDS is split into batches rendered by
+# separate ffmpeg processes and then concatenated
+# Bounds the size of each batch's filter graph (the command line itself is fixed-size)
+MAX_BATCH_CARDS = 50
+# Half the cores, since each x264 still runs at least a couple of threads of its own
+WORKERS = max(1, (os.cpu_count() or 2) // 2)
+THREADS_PER_WORKER = 2  # minimum; raised when there are cores to spare
+# Hardware encoders: the ASIC does the work, and consumer drivers cap how many
+# encode sessions may be open at once (NVENC allows only a handful)
+HW_WORKERS = 2
+
 # -----------------------
 # Helpers
 # -----------------------
 def ensure_dirs():
     OUT_DIR.mkdir(parents=True, exist_ok=True)
-    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+def write_background(tmp_dir: Path):
+    # Background frame, looped as a still image instead of a lavfi color source
+    Image.new("RGB", (WIDTH, HEIGHT), BG_COLOR).save(tmp_dir / "bg.png")
 
 def run(cmd: list[str]):
-    # Print the command for visibility/debug
-    print(" ".join(cmd))
-    subprocess.run(cmd, check=True)
+    # Only name the output here; the full command is included in the error if it fails
+    print(f"{cmd[0]} -> {cmd[-1]}")
+    # Keep ffmpeg's output off the console (slow on Windows, and interleaved when
+    # batches run in parallel); stderr is only shown if the command fails
+    p = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _, err = p.communicate()
+    if p.returncode:
+        raise RuntimeError(
+            f"{cmd[0]} exited with {p.returncode}:\n{' '.join(cmd)}\n{err.decode('utf-8', errors='replace')}"
+        )
 
 def ffmpeg_exists():
     try:
@@ -64,146 +118,387 @@ def ffmpeg_exists():
         print("ERROR: ffmpeg not found on PATH. Install ffmpeg and add its bin folder to PATH.")
         sys.exit(1)
 
-def write_textfile(path: Path, text: str):
-    # UTF-8 w/ LF is usually safest for FFmpeg drawtext on Windows
-    # Ensure text is properly encoded and has no BOM
+def pick_encoder() -> str:
+    """
+    Return the first encoder from ENCODERS that this machine can actually use.
+    A hardware encoder can be compiled into ffmpeg without a matching GPU/driver,
+    so each candidate is checked with a tiny test encode.
+    """
+    listing = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-encoders"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    ).stdout
+    for name, args in ENCODERS.items():
+        if name == "libx264" or name not in listing:
+            continue
+        probe = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"color=c={BG_COLOR}:s={WIDTH}x{HEIGHT}:r={FPS}:d=0.1",
+            "-c:v", name, *args,
+            "-f", "null", "-"
+        ]
+        if subprocess.run(probe, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+            return name
+    return "libx264"
+
+# Loaded fonts keyed by (path, size) - NotoSansJP-VF is several MB, so load each once
+_FONTS: dict[tuple[str, int], ImageFont.FreeTypeFont] = {}
+
+def _get_font(size: int) -> ImageFont.FreeTypeFont:
+    key = (FONT_PATH, size)
+    font = _FONTS.get(key)
+    if font is None:
+        font = _FONTS[key] = ImageFont.truetype(FONT_PATH, size)
+    return font
+
+# Measured advance widths keyed by (path, token, size), so repeated characters and
+# words only hit freetype once
+_WIDTHS: dict[tuple[str, str, int], float] = {}
+
+def _text_width(token: str, size: int) -> float:
+    key = (FONT_PATH, token, size)
+    width = _WIDTHS.get(key)
+    if width is None:
+        width = _WIDTHS[key] = _get_font(size).getlength(token)
+    return width
+
+# Rendered PNGs keyed by (text, size, fill); identical text reuses the first file
+_TEXT_CACHE: dict[tuple[str, int, tuple[int, int, int, int]], Path] = {}
+
+def rasterize_text(path: Path, text: str, font_size: int, fill: tuple[int, int, int, int]) -> Path:
+    """
+    Render (already wrapped) text to a transparent PNG cropped to its bounding box,
+    so ffmpeg only has to alpha-blend it instead of re-rasterizing glyphs every frame.
+    Returns the PNG path, which is an earlier file if the same text was already rendered.
+    """
     if text is None:
         text = ""
-    # Remove any problematic characters and ensure clean newlines
+    # Ensure clean newlines
     text = text.replace("\r\n", "\n").replace("\r", "\n")
-    path.write_text(text, encoding="utf-8", newline="\n")
+
+    key = (text, font_size, fill)
+    cached = _TEXT_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    font = _get_font(font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).multiline_textbbox(
+        (0, 0), text, font=font, spacing=LINE_SPACING
+    )
+    img = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+    ImageDraw.Draw(img).multiline_text((-left, -top), text, font=font, fill=fill, spacing=LINE_SPACING)
+    img.save(path)
+    _TEXT_CACHE[key] = path
+    return path
+
+# Kinsoku shori: characters that may not start a line / may not end a line
+NO_LINE_START = set("。、，．・：；！？」』）】〕〉》］｝ー〜ぁぃぅぇぉっゃゅょゎァィゥェォッャュョヮヵヶ.,:;!?)]}%")
+NO_LINE_END = set("「『（【〔〈《［｛([{")
+
+# CJK ranges: CJK symbols/punctuation (minus the ideographic space), hiragana,
+# katakana, CJK unified ideographs, halfwidth/fullwidth forms
+_CJK = "\u3001-\u303f\u3040-\u30ff\u4e00-\u9fff\uff00-\uffef"
+# (leading whitespace, token): a token is one CJK character or a run of anything else
+_TOKEN_RE = re.compile(rf"(\s*)([{_CJK}]|[^\s{_CJK}]+)")
+
+def _tokenize(text: str) -> list[tuple[str, bool]]:
+    """
+    Split text into breakable tokens as (token, preceded_by_space).
+    Latin words stay whole; every CJK character is its own token, since
+    Japanese has no spaces to break on.
+    """
+    return [(token, bool(space)) for space, token in _TOKEN_RE.findall(text)]
+
+def _join_line(line: list[tuple[str, bool]]) -> str:
+    return "".join((" " if space and i else "") + tok for i, (tok, space) in enumerate(line))
+
+def _optimal_wrap(tokens: list[tuple[str, bool]], widths: list[float], space_w: float, max_w: float) -> list[int]:
+    """
+    Optimal-fit line breaking: choose the breaks minimizing the sum over all lines
+    of (max_w - line_width)**2, so lines come out evenly filled instead of greedy
+    lines followed by a short straggler. Returns the token index each line starts at.
+    A break that would violate kinsoku is only taken if nothing else fits.
+    """
+    n = len(tokens)
+    # allowed[j]: a line may start at token j
+    allowed = [
+        j == 0 or (tokens[j][0][0] not in NO_LINE_START and tokens[j - 1][0][-1] not in NO_LINE_END)
+        for j in range(n)
+    ]
+    kinsoku_penalty = 10 * max_w * max_w
+
+    # cost[i]: best cost of setting tokens[:i]; start[i]: where that last line starts
+    cost = [0.0] + [float("inf")] * n
+    start = [0] * (n + 1)
+    for i in range(1, n + 1):
+        width = 0.0
+        for j in range(i - 1, -1, -1):
+            if j == i - 1:
+                width = widths[j]
+            else:
+                width += widths[j] + (space_w if tokens[j + 1][1] else 0)
+                if width > max_w:
+                    break  # a lone over-wide token is still allowed on its own line
+            c = cost[j] + (max_w - width) ** 2
+            if not allowed[j]:
+                c += kinsoku_penalty
+            if c < cost[i]:
+                cost[i] = c
+                start[i] = j
+
+    breaks = []
+    i = n
+    while i > 0:
+        i = start[i]
+        breaks.append(i)
+    return breaks[::-1]
 
 def wrap_text_for_display(text: str, max_width_px: int, font_size: int) -> str:
     """
     Manually wrap text to fit within max_width_px pixels.
-    Very conservative estimates to prevent clipping - uses safety margin.
+    Widths come from the font itself, so no safety margin is needed.
     """
     if not text:
         return text
     
-    # Apply safety margin (15% reduction) to account for font rendering differences
-    safe_max_width = int(max_width_px * 0.85)
-    
-    words = text.split()
-    if not words:
+    tokens = _tokenize(text)
+    if not tokens:
         return text
     
-    lines = []
-    current_line = []
-    current_pixel_estimate = 0
-    
-    for word in words:
-        # Very conservative width estimation
-        # CJK characters (Japanese/Chinese) as 1.1x font_size (account for full-width)
-        # Other characters as 0.65x font_size (account for variable width)
-        cjk_count = sum(1 for char in word if 
-                       '\u4e00' <= char <= '\u9fff' or  # CJK Unified Ideographs
-                       '\u3040' <= char <= '\u309f' or  # Hiragana
-                       '\u30a0' <= char <= '\u30ff')   # Katakana
-        other_count = len(word) - cjk_count
-        # Use slightly larger multipliers to be safe
-        word_width_px = (cjk_count * font_size * 1.1) + (other_count * font_size * 0.65)
-        space_width_px = font_size * 0.35 if current_line else 0
-        
-        if current_pixel_estimate + word_width_px + space_width_px <= safe_max_width:
-            current_line.append(word)
-            current_pixel_estimate += word_width_px + space_width_px
-        else:
-            if current_line:
-                lines.append(" ".join(current_line))
-            current_line = [word]
-            current_pixel_estimate = word_width_px
-    
-    if current_line:
-        lines.append(" ".join(current_line))
+    # Exact advance widths from freetype (cached per character / word)
+    widths = [_text_width(token, font_size) for token, _ in tokens]
+    breaks = _optimal_wrap(tokens, widths, _text_width(" ", font_size), max_width_px)
+    lines = [tokens[a:b] for a, b in zip(breaks, breaks[1:] + [len(tokens)])]
     
     # Join with newlines - ensure clean UTF-8 encoding
-    result = "\n".join(lines)
+    result = "\n".join(_join_line(line) for line in lines)
     # Remove any problematic characters that might cause encoding issues
     result = result.encode('utf-8', errors='ignore').decode('utf-8')
     return result
 
-def make_clip(idx: int, word: str, reading: str, example_jp: str, example_en: str):
-    # Create per-card textfiles (avoids escaping issues)
-    word_txt = TMP_DIR / f"{idx:04d}_word.txt"
-    reading_txt = TMP_DIR / f"{idx:04d}_reading.txt"
-    jp_txt = TMP_DIR / f"{idx:04d}_jp.txt"
-    en_txt = TMP_DIR / f"{idx:04d}_en.txt"
-
-    write_textfile(word_txt, word.strip())
-    # Wrap text to prevent overflow - use box width for wrapping calculation
-    write_textfile(reading_txt, wrap_text_for_display(reading.strip(), TEXT_MAX_WIDTH, READING_SIZE))
-    write_textfile(jp_txt, wrap_text_for_display(example_jp.strip(), TEXT_MAX_WIDTH, JP_EX_SIZE))
-    write_textfile(en_txt, wrap_text_for_display(example_en.strip(), TEXT_MAX_WIDTH, EN_EX_SIZE))
-
-    out_mp4 = OUT_DIR / f"{idx:04d}.mp4"
-
-    # Enable windows:
-    # - word visible from t=0..WORD_S
-    # - info visible from t=(WORD_S+PAUSE1_S) .. (WORD_S+PAUSE1_S+INFO_S)
-    info_start = WORD_S + PAUSE1_S
-    info_end = info_start + INFO_S
-
-    # Convert Windows paths to format FFmpeg can handle
-    # Use forward slashes and escape colon with backslash
-    def escape_path(p: Path) -> str:
-        path_str = str(p).replace("\\", "/")
-        # Escape colon in drive letter for FFmpeg filter syntax
-        if path_str[1:2] == ":":
-            path_str = path_str[0] + "\\:" + path_str[2:]
-        return path_str
-
-    font_escaped = escape_path(Path(FONT_PATH))
-    word_escaped = escape_path(word_txt)
-    reading_escaped = escape_path(reading_txt)
-    jp_escaped = escape_path(jp_txt)
-    en_escaped = escape_path(en_txt)
-
-    # Build filter string - use single quotes around paths to help FFmpeg parse
-    # Text is pre-wrapped in Python, and boxw constrains maximum width
-    # box=1 with boxborderw=0 creates invisible box to constrain text width
-    vf = (
-        f"drawtext=fontfile='{font_escaped}':textfile='{word_escaped}':fontsize={WORD_SIZE}:fontcolor=white:"
-        f"x=(w-text_w)/2:y=(h-text_h)/2:enable='between(t,0,{WORD_S})',"
-        f"drawtext=fontfile='{font_escaped}':textfile='{reading_escaped}':fontsize={READING_SIZE}:fontcolor=white:"
-        f"box=1:boxborderw=0:boxw={TEXT_MAX_WIDTH}:x=(w-text_w)/2:y={READING_Y}:enable='between(t,{info_start},{info_end})',"
-        f"drawtext=fontfile='{font_escaped}':textfile='{jp_escaped}':fontsize={JP_EX_SIZE}:fontcolor=white:"
-        f"box=1:boxborderw=0:boxw={TEXT_MAX_WIDTH}:x=(w-text_w)/2:y={JP_EX_Y}:enable='between(t,{info_start},{info_end})',"
-        f"drawtext=fontfile='{font_escaped}':textfile='{en_escaped}':fontsize={EN_EX_SIZE}:fontcolor=white@0.92:"
-        f"box=1:boxborderw=0:boxw={TEXT_MAX_WIDTH}:x=(w-text_w)/2:y={EN_EX_Y}:enable='between(t,{info_start},{info_end})'"
-    )
+# One overlay step of the batch graph: load layer n's PNG with a movie source (so the
+# command line stays the same size however many layers there are) and stack it onto
+# the previous result, horizontally centred, visible for start <= t < end
+OVERLAY_TMPL = (
+    "movie='{png}'[t{n}];\n"
+    "[{prev}][t{n}]overlay=x=(W-w)/2:y={y}:enable='gte(t,{start})*lt(t,{end})'[v{n}]"
+)
+
+def escape_path(p: Path) -> str:
+    # Convert Windows paths to format FFmpeg filter options can handle
+    # Use forward slashes and escape colon in drive letter with backslash
+    path_str = str(p).replace("\\", "/")
+    if path_str[1:2] == ":":
+        path_str = path_str[0] + "\\:" + path_str[2:]
+    return path_str
+
+def card_layers(tmp_dir: Path, idx: int, offset: float, word: str, reading: str, example_jp: str, example_en: str) -> list[tuple[Path, str, float, float]]:
+    """
+    Rasterize one card's text and return its overlay layers as (png, y, start, end),
+    shifted so the card occupies [offset, offset + TOTAL_S) of the video.
+    """
+    # Enable windows (half-open so neighbouring cards never share a frame):
+    # - word visible from offset .. offset+WORD_S
+    # - info visible from offset+(WORD_S+PAUSE1_S) .. offset+(WORD_S+PAUSE1_S+INFO_S)
+    word_on = (offset, offset + WORD_S)
+    info_start = offset + WORD_S + PAUSE1_S
+    info_on = (info_start, info_start + INFO_S)
+
+    # Wrap text to prevent overflow
+    texts = [
+        ("word", word.strip(), WORD_SIZE, TEXT_COLOR, "(H-h)/2", word_on),
+        ("reading", wrap_text_for_display(reading.strip(), TEXT_MAX_WIDTH, READING_SIZE), READING_SIZE, TEXT_COLOR, str(READING_Y), info_on),
+        ("jp", wrap_text_for_display(example_jp.strip(), TEXT_MAX_WIDTH, JP_EX_SIZE), JP_EX_SIZE, TEXT_COLOR, str(JP_EX_Y), info_on),
+        ("en", wrap_text_for_display(example_en.strip(), TEXT_MAX_WIDTH, EN_EX_SIZE), EN_EX_SIZE, EN_TEXT_COLOR, str(EN_EX_Y), info_on),
+    ]
+
+    # Empty fields get no layer at all, rather than an overlay of a blank PNG
+    return [
+        (rasterize_text(tmp_dir / f"{idx:04d}_{name}.png", text, size, fill), y, start, end)
+        for name, text, size, fill, y, (start, end) in texts
+        if text
+    ]
+
+def prepare_batch(tmp_dir: Path, batch_no: int, first_idx: int, cards: list[tuple[str, str, str, str]],
+                  out_mp4: Path, encoder: str = "libx264", threads: int = 0) -> tuple[list[str], Path]:
+    """
+    Do all the Python-side work for a run of cards - wrapping, rasterizing, writing
+    the filter script - and return the ffmpeg command that renders it, plus its output.
+    The command is a single pass: one looped background covering the whole batch,
+    with each card's text PNGs overlaid only in its time slot.
+    """
+    layers = []
+    for idx, card in enumerate(cards, start=first_idx):
+        layers += card_layers(tmp_dir, idx, (idx - first_idx) * TOTAL_S, *card)
+
+    # Input 0 is the background; each layer's overlay stacks onto the previous result.
+    # A single-frame PNG source keeps being repeated by overlay.
+    graph = []
+    prev = "0:v"
+    for n, (png, y, start, end) in enumerate(layers, start=1):
+        graph.append(OVERLAY_TMPL.format_map(
+            {"png": escape_path(png), "prev": prev, "n": n, "y": y, "start": start, "end": end}
+        ))
+        prev = f"v{n}"
+    # Terminal label, so the graph stays valid even if every field was empty
+    graph.append(f"[{prev}]null[vout]")
+
+    # The graph grows with every card, so hand it to ffmpeg as a file; with the PNGs
+    # loaded inside the graph, the command line no longer grows at all (Windows caps
+    # the whole command line at 32K characters)
+    filter_path = tmp_dir / f"{batch_no:04d}.filter"
+    filter_path.write_text(";\n".join(graph), encoding="utf-8", newline="\n")
 
     cmd = [
         "ffmpeg", "-y",
-        "-f", "lavfi",
-        "-i", f"color=c={BG_COLOR}:s={WIDTH}x{HEIGHT}:r={FPS}:d={TOTAL_S}",
-        "-vf", vf,
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
+        "-loglevel", "error", "-nostats",
+        "-loop", "1",
+        "-framerate", str(FPS),
+        "-t", str(len(cards) * TOTAL_S),
+        "-i", str(tmp_dir / "bg.png"),
+        "-filter_complex_script", str(filter_path),
+        "-map", "[vout]",
+        "-c:v", encoder,
+        *ENCODERS[encoder],
+        # One keyframe per card is plenty for a slide that never moves
+        "-g", str(FPS * TOTAL_S),
+        # Only x264 threads on the CPU; hardware encoders ignore it
+        *(["-threads", str(threads)] if encoder == "libx264" else []),
         "-r", str(FPS),
+        # moov atom up front so the file opens/streams without reading to the end
+        "-movflags", "+faststart",
         str(out_mp4)
     ]
-    run(cmd)
+    return cmd, out_mp4
+
+def batch_key(cards: list[tuple[str, str, str, str]], encoder: str) -> str:
+    """Hash of everything that affects how a batch renders: its cards and the settings."""
+    settings = (
+        CACHE_VERSION,
+        WIDTH, HEIGHT, FPS, BG_COLOR, FONT_PATH,
+        WORD_S, PAUSE1_S, INFO_S, PAUSE2_S,
+        WORD_SIZE, READING_SIZE, JP_EX_SIZE, EN_EX_SIZE, TEXT_COLOR, EN_TEXT_COLOR,
+        TEXT_MAX_WIDTH, READING_Y, JP_EX_Y, EN_EX_Y, LINE_SPACING,
+        encoder, ENCODERS[encoder],
+    )
+    return hashlib.sha1(repr((settings, cards)).encode("utf-8")).hexdigest()
+
+def place_output(src: Path, dst: Path):
+    # Hard link when possible (no copy of the video data), else a plain copy
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
-def concat_all(num_clips: int):
-    concat_path = OUT_DIR / "concat.txt"
-    lines = [f"file '{i:04d}.mp4'\n" for i in range(1, num_clips + 1)]
+def concat_all(parts: list[Path], final_mp4: Path, tmp_dir: Path):
+    concat_path = tmp_dir / "concat.txt"
+    lines = [f"file '{p.as_posix()}'\n" for p in parts]
     concat_path.write_text("".join(lines), encoding="utf-8", newline="\n")
 
-    final_mp4 = OUT_DIR / "jp_vocab_video.mp4"
     cmd = [
         "ffmpeg", "-y",
+        "-loglevel", "error", "-nostats",
         "-f", "concat",
         "-safe", "0",
+        "-fflags", "+genpts",
         "-i", str(concat_path),
         "-c", "copy",
+        "-movflags", "+faststart",
         str(final_mp4)
     ]
     run(cmd)
+
+def batch_threads(n_cards: int, todo: list, workers: int) -> int:
+    """
+    x264 threads for one pending batch. A lone encode gets every core (0 = auto).
+    When all batches run at once, cores are shared in proportion to batch length, so
+    an uneven split (50 + 10 cards) still finishes together; otherwise evenly.
+    """
+    if len(todo) <= 1:
+        return 0
+    cores = os.cpu_count() or 2
+    if len(todo) <= workers:
+        total_cards = sum(len(cards) for _, (_, cards), _ in todo)
+        return max(THREADS_PER_WORKER, cores * n_cards // total_cards)
+    return max(THREADS_PER_WORKER, cores // workers)
+
+def encode_batches(todo: list, encoder: str, tmp_dir: Path):
+    """Render the given (batch_no, (first_idx, cards), cache_path) batches into the cache."""
+    # Phase 1: all wrapping/rasterizing/command building, before any ffmpeg is started.
+    # Encodes go to a .partial file, so an interrupted run never leaves a bad cache entry.
+    write_background(tmp_dir)
+    workers = WORKERS if encoder == "libx264" else min(WORKERS, HW_WORKERS)
+    tasks = [
+        prepare_batch(
+            tmp_dir, batch_no, first_idx, cards, out.with_suffix(".partial.mp4"), encoder,
+            batch_threads(len(cards), todo, workers)
+        )
+        for batch_no, (first_idx, cards), out in todo
+    ]
+
+    # Phase 2: run the encodes. Each batch is moved into the cache as soon as it
+    # succeeds, so a failure elsewhere doesn't throw away the batches that finished.
+    jobs = [(cmd, partial, out) for (cmd, partial), (_, _, out) in zip(tasks, todo)]
+    if len(jobs) == 1:
+        cmd, partial, out = jobs[0]
+        try:
+            run(cmd)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        os.replace(partial, out)
+    else:
+        print(f"Rendering {len(jobs)} batches on {workers} workers...")
+        error = None
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = {ex.submit(run, cmd): (partial, out) for cmd, partial, out in jobs}
+            for future in as_completed(futures):
+                partial, out = futures[future]
+                if future.exception() is None:
+                    os.replace(partial, out)
+                else:
+                    partial.unlink(missing_ok=True)
+                    error = error or future.exception()
+        if error is not None:
+            raise error
+
+def render_video(rows: list[tuple[str, str, str, str]], encoder: str, tmp_dir: Path):
+    final_mp4 = OUT_DIR / "jp_vocab_video.mp4"
+
+    # Batches hold at most MAX_BATCH_CARDS: any deck that fits in one filter graph is
+    # encoded in a single pass with no concat/remux. Larger decks are split at fixed
+    # MAX_BATCH_CARDS boundaries, so appending cards only changes the last batch's key.
+    batches = [(start + 1, rows[start:start + MAX_BATCH_CARDS]) for start in range(0, len(rows), MAX_BATCH_CARDS)]
+
+    # Batches whose cards and settings are unchanged since a previous run are reused
+    outputs = [CACHE_DIR / f"{batch_key(cards, encoder)}.mp4" for _, cards in batches]
+    # Identical batches (e.g. a deck that repeats its cards for review) share one key,
+    # so each missing key is encoded once and every position reuses that output
+    todo = []
+    seen = set()
+    for n, (batch, out) in enumerate(zip(batches, outputs), start=1):
+        if out not in seen and not out.exists():
+            todo.append((n, batch, out))
+        seen.add(out)
+    print(f"{len(batches)} batches, {len(todo)} to encode")
+
+    # Fully cached (e.g. a re-run on an unchanged deck): nothing to rasterize or encode
+    if todo:
+        encode_batches(todo, encoder, tmp_dir)
+
+    # The previous final file may be a hard link into the cache; never write through it
+    final_mp4.unlink(missing_ok=True)
+    if len(outputs) == 1:
+        place_output(outputs[0], final_mp4)
+    else:
+        print("\nConcatenating...")
+        concat_all(outputs, final_mp4, tmp_dir)
+
     print(f"\nDONE: {final_mp4}")
 
 def main():
     ffmpeg_exists()
+    encoder = pick_encoder()
     ensure_dirs()
 
     if not CSV_PATH.exists():
@@ -212,32 +507,33 @@ def main():
 
     # Your CSV: tab-delimited with fields:
     # word    reading    example_jp    example_en
+    # Rows are kept as (word, reading, example_jp, example_en) tuples
     with CSV_PATH.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f, delimiter="\t")
-        required = {"word", "reading", "example_jp", "example_en"}
-        if not reader.fieldnames or not required.issubset(set(reader.fieldnames)):
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader, [])
+        required = ("word", "reading", "example_jp", "example_en")
+        if not set(required).issubset(header):
             print("ERROR: CSV headers must be exactly: word<TAB>reading<TAB>example_jp<TAB>example_en")
-            print(f"Found headers: {reader.fieldnames}")
+            print(f"Found headers: {header}")
             sys.exit(1)
 
-        rows = list(reader)
+        idx_w, idx_r, idx_jp, idx_en = (header.index(c) for c in required)
+        width = len(header)
+        rows = []
+        for row in reader:
+            if not row:
+                continue  # blank line
+            if len(row) < width:
+                row += [""] * (width - len(row))
+            rows.append((row[idx_w], row[idx_r], row[idx_jp], row[idx_en]))
 
     if not rows:
         print("ERROR: CSV has no rows.")
         sys.exit(1)
 
-    print(f"Rendering {len(rows)} clips...")
-    for idx, row in enumerate(rows, start=1):
-        make_clip(
-            idx,
-            row.get("word", ""),
-            row.get("reading", ""),
-            row.get("example_jp", ""),
-            row.get("example_en", "")
-        )
-
-    print("\nConcatenating...")
-    concat_all(len(rows))
+    print(f"Rendering {len(rows)} cards with {encoder}...")
+    with tempfile.TemporaryDirectory(prefix="jpvideo_") as td:
+        render_video(rows, encoder, Path(td))
 
 if __name__ == "__main__":
     main()